@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+
+import google.generativeai as genai
+
+from captions import process_caption, structured_from_json, WASTE_ANALYSIS_SCHEMA
+
+# orjson decodes noticeably faster when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Model calls shared by the Streamlit app and the background job workers.
+# Nothing in here touches Streamlit, so it can run in any process.
+
+DEFAULT_IMAGE_PROMPT = "Analyze this image and identify any waste or recyclable materials present. What type of waste is it and how should it be disposed of?"
+
+# Appended to prompts in structured mode, where the reply must follow WASTE_ANALYSIS_SCHEMA
+STRUCTURED_INSTRUCTIONS = "Reply with a one-sentence summary, a confidence between 0 and 1 for each waste type present, whether it is recyclable, its hazard level and at most five short disposal steps."
+
+STRUCTURED_GENERATION_CONFIG = genai.GenerationConfig(
+    response_mime_type="application/json",
+    response_schema=WASTE_ANALYSIS_SCHEMA,
+    max_output_tokens=512
+)
+
+# Default model for structured mode, which needs response schema support
+STRUCTURED_DEFAULT_MODEL = 'gemini-1.5-flash'
+# Models that reject response_mime_type and response_schema
+UNSTRUCTURED_MODELS = {'gemini-pro', 'gemini-pro-vision', 'gemini-1.0-pro', 'gemini-1.0-pro-vision'}
+
+# Configure Gemini and create the text and vision models
+def load_gemini_models(api_key, structured_output=False):
+    if structured_output:
+        text_model_name = os.getenv('GEMINI_TEXT_MODEL', STRUCTURED_DEFAULT_MODEL)
+        vision_model_name = os.getenv('GEMINI_VISION_MODEL', STRUCTURED_DEFAULT_MODEL)
+        for model_name in (text_model_name, vision_model_name):
+            if model_name.removeprefix('models/') in UNSTRUCTURED_MODELS:
+                raise ValueError(f"{model_name} does not support structured output; set GEMINI_TEXT_MODEL and GEMINI_VISION_MODEL to a model such as {STRUCTURED_DEFAULT_MODEL}")
+    else:
+        text_model_name = os.getenv('GEMINI_TEXT_MODEL', 'gemini-pro')
+        vision_model_name = os.getenv('GEMINI_VISION_MODEL', 'gemini-pro-vision')
+
+    genai.configure(api_key=api_key)
+    return genai.GenerativeModel(text_model_name), genai.GenerativeModel(vision_model_name)
+
+def generate_response(text_model, prompt):
+    try:
+        if text_model is None:
+            return "Text model not initialized. Please check your API key."
+
+        response = text_model.generate_content(prompt)
+        return response.text
+    except Exception as e:
+        return f"Error generating response: {str(e)}"
+
+def analyze_image(vision_model, image_bytes, prompt=DEFAULT_IMAGE_PROMPT):
+    try:
+        if vision_model is None:
+            return "Vision model not initialized. Please check your API key."
+
+        response = vision_model.generate_content([prompt, image_bytes])
+        return response.text
+    except Exception as e:
+        return f"Error analyzing image: {str(e)}"
+
+# Schema-constrained request; the reply is decoded and validated, never parsed as free text
+def request_structured(model, contents, model_name):
+    try:
+        if model is None:
+            return {"raw": f"{model_name} model not initialized. Please check your API key.", "structured": None}
+
+        response = model.generate_content(contents, generation_config=STRUCTURED_GENERATION_CONFIG)
+        try:
+            structured = structured_from_json(json_loads(response.text))
+        except ValueError as e:
+            return {"raw": f"Error reading structured response: {str(e)}", "structured": None}
+        return {"raw": response.text, "structured": structured}
+    except Exception as e:
+        return {"raw": f"Error requesting structured analysis: {str(e)}", "structured": None}
+
+# Raw caption plus its structured form (None when the call failed)
+def describe_image(vision_model, image_bytes, prompt=DEFAULT_IMAGE_PROMPT, structured_output=False):
+    if structured_output:
+        return request_structured(vision_model, [f"{prompt} {STRUCTURED_INSTRUCTIONS}", image_bytes], "Vision")
+
+    caption = analyze_image(vision_model, image_bytes, prompt)
+    structured = None if is_error_response(caption) else process_caption(caption)
+    return {"raw": caption, "structured": structured}
+
+# Suggestions text plus, in structured mode, the validated fields
+def generate_suggestions(text_model, prompt, waste_type=None, structured_output=False):
+    try:
+        if waste_type:
+            prompt = f"As a waste management expert, provide detailed suggestions for disposing of {waste_type}. {prompt}"
+        else:
+            prompt = f"As a waste management expert, analyze this waste and provide disposal suggestions: {prompt}"
+
+        if structured_output:
+            return request_structured(text_model, f"{prompt} {STRUCTURED_INSTRUCTIONS}", "Text")
+        return {"raw": generate_response(text_model, prompt), "structured": None}
+    except Exception as e:
+        return {"raw": f"Error generating suggestions: {str(e)}", "structured": None}
+
+# Responses from the error paths above, which should never be cached
+def is_error_response(result):
+    text = result["raw"] if isinstance(result, dict) else result
+    return text.startswith("Error") or text.endswith("Please check your API key.")
+
+# Shared-cache keys for model results, identical in the app and the workers
+MODEL_CACHE_TTL = 24 * 60 * 60
+
+def suggestions_cache_key(prompt, waste_type=None, structured_output=False):
+    digest = hashlib.sha256(f"{int(structured_output)}\n{waste_type or ''}\n{prompt}".encode('utf-8')).hexdigest()
+    return f"suggestions:{digest}"
+
+def image_cache_key(image_bytes, prompt=DEFAULT_IMAGE_PROMPT, structured_output=False):
+    digest = hashlib.sha256(f"{int(structured_output)}\n{prompt}".encode('utf-8') + image_bytes).hexdigest()
+    return f"image:{digest}"
@@ -0,0 +1,260 @@
+import re
+
+# Post-processing of model captions. Free-text captions have repeated
+# sentences and n-gram loops removed and the structured fields the UI
+# displays extracted, in a single linear pass; schema-constrained JSON
+# responses are validated into the same structured result.
+
+# Waste categories shown in the classification chart, with their defaults
+WASTE_TYPES = {
+    "Plastic": {"recyclable": True, "hazard_level": "Medium"},
+    "Paper": {"recyclable": True, "hazard_level": "Low"},
+    "Metal": {"recyclable": True, "hazard_level": "Low"},
+    "Glass": {"recyclable": True, "hazard_level": "Medium"},
+    "Organic": {"recyclable": True, "hazard_level": "Low"}
+}
+
+# Words that hint at each waste category
+WASTE_KEYWORDS = {
+    "Plastic": ["plastic", "bottle", "container", "packaging"],
+    "Paper": ["paper", "cardboard", "box", "newspaper"],
+    "Metal": ["metal", "can", "aluminum", "steel"],
+    "Glass": ["glass", "bottle", "jar"],
+    "Organic": ["food", "waste", "organic", "vegetable", "fruit"]
+}
+
+HAZARD_WORDS = {"hazardous", "toxic", "battery", "batteries", "chemical", "chemicals", "sharp", "flammable", "corrosive", "asbestos"}
+NON_RECYCLABLE_PHRASES = ("not recyclable", "non-recyclable", "cannot be recycled", "can't be recycled", "not be recycled")
+RECYCLABLE_WORDS = {"recyclable", "recycle", "recycled", "recycling"}
+# Words that make any line a disposal step, and that mark a disposal heading
+DISPOSAL_WORDS = {"dispose", "disposal", "disposing", "discard", "recycle", "recycling", "compost", "composting", "bin", "drop-off"}
+# Verbs that make a line a step only when it starts with them ("Rinse the bottle."),
+# since they also turn up in facts ("can take up to 450 years")
+DISPOSAL_VERBS = {"rinse", "wash", "clean", "empty", "place", "put", "take", "drop", "separate", "remove", "sort", "flatten", "crush"}
+
+# Longest token sequence checked for immediate repetition
+MAX_LOOP_NGRAM = 8
+MAX_DISPOSAL_STEPS = 5
+PUNCTUATION = '.,;:!?'
+
+# Words before a singular "can" that make it the container rather than the verb
+CAN_NOUN_CUES = {"a", "an", "the", "this", "that", "each", "every", "one", "soda", "tin", "aluminum", "aluminium", "metal", "steel", "beer", "drink", "food", "empty", "crushed", "paint", "aerosol", "spray", "used", "old", "dented"}
+
+KEYWORD_INDEX = {}
+for waste_type, related_words in WASTE_KEYWORDS.items():
+    for word in related_words:
+        KEYWORD_INDEX.setdefault(word, []).append(waste_type)
+
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+LIST_ITEM_RE = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s+')
+WORD_RE = re.compile(r"[a-z]+(?:-[a-z]+)*")
+
+# Drop a token sequence (2 to MAX_LOOP_NGRAM long) repeated back to back, and
+# any word repeated three or more times in a row, keeping the first copy. A
+# word doubled once can be legitimate ("had had", "bye bye"). Checking a
+# bounded window after every token keeps this linear in the length of the text.
+def collapse_loops(tokens):
+    out = []
+    keys = []
+    repeats = 0
+    for token in tokens:
+        key = token.lower().strip(PUNCTUATION)
+        repeats = repeats + 1 if keys and key == keys[-1] else 0
+        if repeats >= 2:
+            # Third copy of a word: drop it and the second copy, keeping any sentence punctuation
+            if repeats == 2:
+                del out[-1]
+                del keys[-1]
+            punctuation = token[len(token.rstrip(PUNCTUATION)):] or out[-1][len(out[-1].rstrip(PUNCTUATION)):]
+            out[-1] = out[-1].rstrip(PUNCTUATION) + punctuation
+            continue
+        out.append(token)
+        keys.append(key)
+        for n in range(2, MAX_LOOP_NGRAM + 1):
+            if len(keys) < 2 * n:
+                break
+            if keys[-n:] == keys[-2 * n:-n]:
+                # Keep sentence punctuation that was attached to the dropped copy
+                punctuation = out[-1][len(out[-1].rstrip(PUNCTUATION)):]
+                del out[-n:]
+                del keys[-n:]
+                out[-1] = out[-1].rstrip(PUNCTUATION) + punctuation
+                break
+    return out
+
+# Keyword a word refers to, accepting regular plurals ("jars", "boxes"), or None
+def find_keyword(word):
+    if word in KEYWORD_INDEX:
+        return word
+    if word.endswith('es') and word[:-2] in KEYWORD_INDEX:
+        return word[:-2]
+    if word.endswith('s') and word[:-1] in KEYWORD_INDEX:
+        return word[:-1]
+    return None
+
+# Normalized caption text plus the fields extracted from it
+def process_caption(text):
+    seen_sentences = set()
+    kept_lines = []
+    disposal_steps = []
+    matched_keywords = {waste_type: set() for waste_type in WASTE_TYPES}
+    hazard_found = False
+    recyclable = None
+    # Set by a heading such as "Disposal steps:"; list items under it are steps
+    in_disposal_section = False
+
+    for line in text.splitlines():
+        # List markers such as "1." must not be mistaken for sentence ends
+        marker = LIST_ITEM_RE.match(line)
+        is_list_item = marker is not None
+        body = line[marker.end():] if marker else line
+        kept_sentences = []
+        for sentence in SENTENCE_RE.split(body.strip()):
+            tokens = collapse_loops(sentence.split())
+            if not tokens:
+                continue
+            sentence = ' '.join(tokens)
+            key = ' '.join(sentence.lower().split())
+            if key in seen_sentences:
+                continue
+            seen_sentences.add(key)
+            kept_sentences.append(sentence)
+
+            lowered = sentence.lower()
+            words = WORD_RE.findall(lowered)
+            for position, word in enumerate(words):
+                keyword = find_keyword(word)
+                # "it can be recycled" uses the verb; "a can" or "soda cans" the container
+                if word == "can" and (position == 0 or words[position - 1] not in CAN_NOUN_CUES):
+                    keyword = None
+                for waste_type in KEYWORD_INDEX.get(keyword, ()):
+                    matched_keywords[waste_type].add(keyword)
+                if word in HAZARD_WORDS:
+                    hazard_found = True
+            if any(phrase in lowered for phrase in NON_RECYCLABLE_PHRASES):
+                recyclable = False
+            elif recyclable is None and RECYCLABLE_WORDS.intersection(words):
+                recyclable = True
+            step = sentence.replace('**', '').strip()
+            mentions_disposal = any(
+                word in DISPOSAL_WORDS or word.rstrip('s') in DISPOSAL_WORDS for word in words
+            )
+            is_instruction = bool(words) and words[0] in DISPOSAL_VERBS
+            if step.endswith(':') or step.startswith('#'):
+                in_disposal_section = mentions_disposal
+            elif len(disposal_steps) < MAX_DISPOSAL_STEPS and (mentions_disposal or is_instruction or (is_list_item and in_disposal_section)):
+                disposal_steps.append(step)
+        if kept_sentences:
+            prefix = marker.group(0).strip() + ' ' if marker else ''
+            kept_lines.append(prefix + ' '.join(kept_sentences))
+
+    # Share of each category's keywords that appear, capped and normalized as before
+    waste_types = {}
+    for waste_type, defaults in WASTE_TYPES.items():
+        confidence = len(matched_keywords[waste_type]) / len(WASTE_KEYWORDS[waste_type])
+        waste_types[waste_type] = {"confidence": min(confidence, 0.95), **defaults}
+    total_confidence = sum(details["confidence"] for details in waste_types.values())
+    for details in waste_types.values():
+        details["confidence"] = details["confidence"] / total_confidence if total_confidence > 0 else 0.2
+
+    top_type = max(waste_types, key=lambda waste_type: waste_types[waste_type]["confidence"])
+    if recyclable is not None:
+        waste_types[top_type]["recyclable"] = recyclable
+    if hazard_found:
+        waste_types[top_type]["hazard_level"] = "High"
+
+    return {
+        "summary": '\n'.join(kept_lines),
+        "waste_types": waste_types,
+        "primary_type": top_type,
+        "recyclable": waste_types[top_type]["recyclable"],
+        "hazard_level": waste_types[top_type]["hazard_level"],
+        "disposal_steps": disposal_steps
+    }
+
+# Result shown when no caption is available
+def default_structured_result():
+    waste_types = {waste_type: {"confidence": 0.2, **defaults} for waste_type, defaults in WASTE_TYPES.items()}
+    return {
+        "summary": "",
+        "waste_types": waste_types,
+        "primary_type": "Plastic",
+        "recyclable": True,
+        "hazard_level": waste_types["Plastic"]["hazard_level"],
+        "disposal_steps": []
+    }
+
+HAZARD_LEVELS = ("Low", "Medium", "High")
+
+# JSON schema for schema-constrained model responses; parses into the same
+# structured result as process_caption
+WASTE_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "summary": {"type": "string"},
+        "waste_types": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "type": {"type": "string", "enum": list(WASTE_TYPES)},
+                    "confidence": {"type": "number"},
+                    "recyclable": {"type": "boolean"},
+                    "hazard_level": {"type": "string", "enum": list(HAZARD_LEVELS)}
+                },
+                "required": ["type", "confidence", "recyclable", "hazard_level"]
+            }
+        },
+        "recyclable": {"type": "boolean"},
+        "hazard_level": {"type": "string", "enum": list(HAZARD_LEVELS)},
+        "disposal_steps": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["summary", "waste_types", "recyclable", "hazard_level", "disposal_steps"]
+}
+
+# Python types for the JSON schema types used in WASTE_ANALYSIS_SCHEMA
+SCHEMA_TYPES = {"object": dict, "array": list, "string": str, "number": (int, float), "boolean": bool}
+
+# Raise ValueError unless value matches schema; path names the field in the message
+def check_schema(value, schema, path="response"):
+    expected = SCHEMA_TYPES[schema["type"]]
+    # bool is a subclass of int, but true/false is not a valid number
+    if not isinstance(value, expected) or (schema["type"] == "number" and isinstance(value, bool)):
+        raise ValueError(f"{path} should be of type {schema['type']}, got {type(value).__name__}")
+    if "enum" in schema and value not in schema["enum"]:
+        raise ValueError(f"{path} has unknown value {value!r}")
+    if schema["type"] == "object":
+        for field in schema.get("required", ()):
+            if field not in value:
+                raise ValueError(f"{path} is missing '{field}'")
+        for field, field_schema in schema["properties"].items():
+            if field in value:
+                check_schema(value[field], field_schema, f"{path}.{field}")
+    elif schema["type"] == "array":
+        for index, item in enumerate(value):
+            check_schema(item, schema["items"], f"{path}[{index}]")
+
+# Validate a decoded schema-constrained response; raises ValueError if it does not match
+def structured_from_json(data):
+    check_schema(data, WASTE_ANALYSIS_SCHEMA)
+
+    waste_types = {waste_type: {"confidence": 0.0, **defaults} for waste_type, defaults in WASTE_TYPES.items()}
+    for item in data["waste_types"]:
+        waste_types[item["type"]] = {
+            "confidence": min(max(float(item["confidence"]), 0.0), 1.0),
+            "recyclable": item["recyclable"],
+            "hazard_level": item["hazard_level"]
+        }
+    total_confidence = sum(details["confidence"] for details in waste_types.values())
+    for details in waste_types.values():
+        details["confidence"] = details["confidence"] / total_confidence if total_confidence > 0 else 0.2
+
+    top_type = max(waste_types, key=lambda waste_type: waste_types[waste_type]["confidence"])
+    return {
+        "summary": data["summary"],
+        "waste_types": waste_types,
+        "primary_type": top_type,
+        "recyclable": data["recyclable"],
+        "hazard_level": data["hazard_level"],
+        "disposal_steps": data["disposal_steps"][:MAX_DISPOSAL_STEPS]
+    }
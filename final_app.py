@@ -1,7 +1,6 @@
 import streamlit as st
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 import pandas as pd
 import numpy as np
 import plotly.express as px
@@ -14,23 +13,80 @@ from geopy.distance import geodesic
 import json
 from datetime import datetime
 import uuid
+import io
+import html
+import sys
+import time
+
+import analysis
+from captions import default_structured_result
+from job_queue import JobQueue, JOB_TIMEOUT
+from state_backend import get_state_backend
 
 # Load environment variables
 load_dotenv()
 
-# Initialize session state for points and achievements
-if 'user_points' not in st.session_state:
-    st.session_state.user_points = 0
-if 'achievements' not in st.session_state:
-    st.session_state.achievements = []
-if 'user_level' not in st.session_state:
-    st.session_state.user_level = 1
-if 'analyses_completed' not in st.session_state:
-    st.session_state.analyses_completed = 0
-if 'locations_found' not in st.session_state:
-    st.session_state.locations_found = 0
-if 'user_id' not in st.session_state:
-    st.session_state.user_id = str(uuid.uuid4())
+# Compact per-session progress record, kept in session state as a single object
+class UserProgress:
+    __slots__ = ('user_id', 'points', 'level', 'achievements', 'analyses_completed', 'locations_found')
+
+    user_id: str
+    points: int
+    level: int
+    achievements: list
+    analyses_completed: int
+    locations_found: int
+
+    def __init__(self, user_id=None):
+        self.user_id = user_id or str(uuid.uuid4())
+        self.points = 0
+        self.level = 1
+        self.achievements = []
+        self.analyses_completed = 0
+        self.locations_found = 0
+
+    def to_dict(self):
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data):
+        progress = cls(data['user_id'])
+        for slot in cls.__slots__:
+            if slot in data:
+                setattr(progress, slot, data[slot])
+        return progress
+
+# Shared state backend (progress, model results, geocoding), one per process
+@st.cache_resource(show_spinner=False)
+def get_shared_state():
+    return get_state_backend()
+
+shared_state = get_shared_state()
+
+# Progress is stored in the shared backend under a user id carried in the URL,
+# so it survives reconnecting to a different app process or node
+def load_user_progress():
+    user_id = st.query_params.get('uid')
+    try:
+        uuid.UUID(user_id)
+    except (TypeError, ValueError):
+        user_id = None
+    if user_id:
+        stored = shared_state.get(f"progress:{user_id}")
+        if stored:
+            return UserProgress.from_dict(stored)
+    progress = UserProgress(user_id)
+    st.query_params['uid'] = progress.user_id
+    return progress
+
+# Initialize session state for points and achievements. The stored record is
+# re-read on every run, so points earned in another tab with the same uid show up.
+if 'progress' not in st.session_state:
+    st.session_state.progress = load_user_progress()
+else:
+    stored = shared_state.get(f"progress:{st.session_state.progress.user_id}")
+    if stored:
+        st.session_state.progress = UserProgress.from_dict(stored)
 
 # Achievement definitions
 ACHIEVEMENTS = {
@@ -49,38 +105,59 @@ POINTS_SYSTEM = {
     'achievement': 50
 }
 
-# Function to update user points and check achievements
-def update_points_and_achievements(action_type):
+# Apply an action to a progress record; returns the achievements it unlocked
+def apply_action(progress, action_type):
+    unlocked = []
     # Add points
     points = POINTS_SYSTEM.get(action_type, 0)
-    st.session_state.user_points += points
+    progress.points += points
     
     # Update level (every 200 points = 1 level)
-    st.session_state.user_level = (st.session_state.user_points // 200) + 1
+    progress.level = (progress.points // 200) + 1
     
     # Check for achievements
     if action_type == 'analysis':
-        st.session_state.analyses_completed += 1
-        if st.session_state.analyses_completed == 1 and 'first_analysis' not in st.session_state.achievements:
-            st.session_state.achievements.append('first_analysis')
-            st.balloons()
-            st.success(f" Achievement Unlocked: {ACHIEVEMENTS['first_analysis']['name']}")
-        elif st.session_state.analyses_completed == 10 and 'eco_warrior' not in st.session_state.achievements:
-            st.session_state.achievements.append('eco_warrior')
-            st.balloons()
-            st.success(f" Achievement Unlocked: {ACHIEVEMENTS['eco_warrior']['name']}")
+        progress.analyses_completed += 1
+        if progress.analyses_completed == 1 and 'first_analysis' not in progress.achievements:
+            unlocked.append('first_analysis')
+        elif progress.analyses_completed == 10 and 'eco_warrior' not in progress.achievements:
+            unlocked.append('eco_warrior')
     
     elif action_type == 'location_search':
-        st.session_state.locations_found += 1
-        if st.session_state.locations_found == 5 and 'location_master' not in st.session_state.achievements:
-            st.session_state.achievements.append('location_master')
-            st.balloons()
-            st.success(f" Achievement Unlocked: {ACHIEVEMENTS['location_master']['name']}")
-    
-    if st.session_state.user_level >= 5 and 'green_expert' not in st.session_state.achievements:
-        st.session_state.achievements.append('green_expert')
+        progress.locations_found += 1
+        if progress.locations_found == 5 and 'location_master' not in progress.achievements:
+            unlocked.append('location_master')
+    
+    if progress.level >= 5 and 'green_expert' not in progress.achievements:
+        unlocked.append('green_expert')
+    
+    progress.achievements.extend(unlocked)
+    return unlocked
+
+# Function to update user points and check achievements. The change is applied to
+# the stored record in one atomic update, so sessions sharing a uid never
+# overwrite each other's points.
+def update_points_and_achievements(action_type):
+    user_id = st.session_state.progress.user_id
+    unlocked = []
+
+    def apply(stored):
+        progress = UserProgress.from_dict(stored) if stored else UserProgress(user_id)
+        unlocked[:] = apply_action(progress, action_type)
+        return progress.to_dict()
+
+    st.session_state.progress = UserProgress.from_dict(shared_state.update(f"progress:{user_id}", apply))
+    for achievement_id in unlocked:
         st.balloons()
-        st.success(f" Achievement Unlocked: {ACHIEVEMENTS['green_expert']['name']}")
+        st.success(f" Achievement Unlocked: {ACHIEVEMENTS[achievement_id]['name']}")
+
+# Ask the models for schema-constrained JSON instead of free text when ECOQUEST_STRUCTURED_OUTPUT is set
+STRUCTURED_OUTPUT = bool(os.getenv('ECOQUEST_STRUCTURED_OUTPUT'))
+
+# Gemini clients are created once per process and shared by every session
+@st.cache_resource(show_spinner=False)
+def load_gemini_models(api_key, structured_output):
+    return analysis.load_gemini_models(api_key, structured_output)
 
 # Initialize Gemini API
 def initialize_gemini():
@@ -90,67 +167,122 @@ def initialize_gemini():
             st.error("Please set your Google API key in the environment variables as GOOGLE_API_KEY")
             return None, None
         
-        genai.configure(api_key=api_key)
-        text_model = genai.GenerativeModel('gemini-pro')
-        vision_model = genai.GenerativeModel('gemini-pro-vision')
-        return text_model, vision_model
+        return load_gemini_models(api_key, STRUCTURED_OUTPUT)
     except Exception as e:
         st.error(f"Error initializing Gemini API: {str(e)}")
         return None, None
 
-# Initialize models in session state if not already done
-if 'text_model' not in st.session_state or 'vision_model' not in st.session_state:
-    st.session_state.text_model, st.session_state.vision_model = initialize_gemini()
+text_model, vision_model = initialize_gemini()
 
-def generate_response(prompt):
-    try:
-        if st.session_state.text_model is None:
-            return "Text model not initialized. Please check your API key."
-        
-        response = st.session_state.text_model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        return f"Error generating response: {str(e)}"
+# Slow model calls go through the background job queue when ECOQUEST_JOB_QUEUE is set
+@st.cache_resource(show_spinner=False)
+def get_job_queue():
+    return JobQueue()
 
-def analyze_image(image, prompt="Analyze this image and identify any waste or recyclable materials present. What type of waste is it and how should it be disposed of?"):
-    try:
-        if st.session_state.vision_model is None:
-            return "Vision model not initialized. Please check your API key."
-        
-        # Convert PIL Image to bytes
-        import io
+job_queue = get_job_queue() if os.getenv('ECOQUEST_JOB_QUEUE') else None
+
+# Seconds between checks while a session is waiting on a queued job
+JOB_POLL_INTERVAL = 1.0
+
+# Result of a finished or expired job, or None while it is still queued or running
+def poll_job(job_id, submitted_at):
+    job = job_queue.get(job_id)
+    if job is None:
+        return {"raw": "Error: analysis job was lost. Please try again.", "structured": None}
+    if job['status'] == 'done':
+        job_queue.delete(job_id)
+        return job['result']
+    if job['status'] == 'failed':
+        job_queue.delete(job_id)
+        return {"raw": f"Error running analysis job: {job['error']}", "structured": None}
+    if time.time() - submitted_at > JOB_TIMEOUT:
+        job_queue.delete(job_id)
+        return {"raw": "Error: analysis timed out waiting for a worker. Please try again.", "structured": None}
+    return None
+
+# Waiting message that checks on its job without rerunning the rest of the page,
+# then reruns the whole app once the job has finished, failed or expired
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def job_waiting_panel(job_id, submitted_at, message):
+    job = job_queue.get(job_id)
+    if job is None or job['status'] in ('done', 'failed') or time.time() - submitted_at > JOB_TIMEOUT:
+        st.rerun()
+    st.info(message)
+
+# Longest image edge sent to the vision model
+MAX_IMAGE_EDGE = 1024
+
+# Decode an upload at reduced size and re-encode it, releasing the full-resolution buffer
+def prepare_image(uploaded_file):
+    with Image.open(uploaded_file) as image:
+        image_format = image.format if image.format else 'PNG'
+        # JPEG decoder can scale down while decoding, so the full bitmap is never built
+        image.draft(None, (MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
+        image.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE))
         img_byte_arr = io.BytesIO()
-        image.save(img_byte_arr, format=image.format if image.format else 'PNG')
-        img_byte_arr = img_byte_arr.getvalue()
-        
-        response = st.session_state.vision_model.generate_content([prompt, img_byte_arr])
-        return response.text
-    except Exception as e:
-        return f"Error analyzing image: {str(e)}"
+        image.save(img_byte_arr, format=image_format)
+    return img_byte_arr.getvalue()
+
+# Model results are cached in the shared state backend for every app process
+def cached_model_call(cache_key, compute):
+    result = shared_state.get(cache_key)
+    if result is None:
+        result = compute()
+        if not analysis.is_error_response(result):
+            shared_state.set(cache_key, result, ttl=analysis.MODEL_CACHE_TTL)
+    return result
+
+# Raw response and its structured fields, cached together
+def analyze_image(image_bytes, prompt=analysis.DEFAULT_IMAGE_PROMPT):
+    return cached_model_call(
+        analysis.image_cache_key(image_bytes, prompt, STRUCTURED_OUTPUT),
+        lambda: analysis.describe_image(vision_model, image_bytes, prompt, STRUCTURED_OUTPUT)
+    )
 
 def generate_suggestions(prompt, waste_type=None):
-    try:
-        if waste_type:
-            prompt = f"As a waste management expert, provide detailed suggestions for disposing of {waste_type}. {prompt}"
-        else:
-            prompt = f"As a waste management expert, analyze this waste and provide disposal suggestions: {prompt}"
-        
-        response = generate_response(prompt)
-        return response
-    except Exception as e:
-        return f"Error generating suggestions: {str(e)}"
-
-# Function to clean up repetitive text in captions
-def clean_caption(text):
-    # Split into words and remove duplicates while maintaining order
-    words = text.split()
-    seen = set()
-    cleaned_words = []
-    for word in words:
-        if word.lower() not in seen:
-            cleaned_words.append(word)
-            seen.add(word.lower())
-    return ' '.join(cleaned_words)
+    return cached_model_call(
+        analysis.suggestions_cache_key(prompt, waste_type, STRUCTURED_OUTPUT),
+        lambda: analysis.generate_suggestions(text_model, prompt, waste_type, STRUCTURED_OUTPUT)
+    )
+
+# Suggestions card body: the validated fields in structured mode, otherwise the model's text
+def format_suggestions(suggestions):
+    structured = suggestions['structured']
+    if not structured:
+        return suggestions['raw']
+    steps = "".join(f"<li>{html.escape(step)}</li>" for step in structured['disposal_steps'])
+    return f"{html.escape(structured['summary'])}<ul style='margin: 0.5rem 0 0;'>{steps}</ul>"
+
+# Geocoding results are shared too; Nominatim allows about one request per second
+GEOCODE_CACHE_TTL = 7 * 24 * 60 * 60
+
+# (lat, lon) for an address, or None if it cannot be found
+def geocode_address(address):
+    cache_key = f"geocode:{address.strip().lower()}"
+    coords = shared_state.get(cache_key)
+    if coords is None:
+        geolocator = Nominatim(user_agent="waste_analyzer")
+        location = geolocator.geocode(address)
+        coords = [location.latitude, location.longitude] if location else []
+        shared_state.set(cache_key, coords, ttl=GEOCODE_CACHE_TTL)
+    return tuple(coords) if coords else None
+
+def reverse_geocode(lat, lon):
+    cache_key = f"reverse:{lat:.4f},{lon:.4f}"
+    address = shared_state.get(cache_key)
+    if address is None:
+        geolocator = Nominatim(user_agent="waste_analyzer")
+        location = geolocator.reverse((lat, lon))
+        address = location.address if location else ""
+        shared_state.set(cache_key, address, ttl=GEOCODE_CACHE_TTL)
+    return address
+
+# Shown when the analysis did not suggest any disposal steps
+DEFAULT_RECOMMENDATIONS = [
+    "Ensure proper segregation before disposal",
+    "Check local recycling guidelines",
+    "Consider reuse options if applicable"
+]
 
 # Function to get nearby waste disposal locations
 def get_nearby_disposal_locations(lat, lon, waste_type):
@@ -211,8 +343,95 @@ def get_eco_tips(carbon_footprint):
             "Consider joining local environmental initiatives"
         ]
 
-# Custom CSS for enhanced UI
-st.markdown("""
+# Approximate number of bytes retained by an object graph
+def deep_sizeof(obj, seen=None):
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(deep_sizeof(getattr(obj, slot), seen) for slot in obj.__slots__ if hasattr(obj, slot))
+    elif hasattr(obj, '__dict__'):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+# Bytes currently held by this session's state
+def session_state_bytes():
+    return deep_sizeof({key: st.session_state[key] for key in st.session_state.keys()})
+
+# Bytes held by this session when it was idle (after its first run, before any
+# interaction) versus now
+def session_memory_report():
+    return {
+        'idle_session_bytes': st.session_state.idle_session_bytes,
+        'active_session_bytes': session_state_bytes()
+    }
+
+# Achievements panel HTML, rebuilt only when the unlocked set changes
+@st.cache_data(show_spinner=False)
+def render_achievements_panel(unlocked_ids):
+    items = []
+    for achievement_id, achievement in ACHIEVEMENTS.items():
+        is_unlocked = achievement_id in unlocked_ids
+        items.append(f"""
+            <div class='achievement {"" if is_unlocked else "locked"}'>
+                <strong>{achievement['name']}</strong><br>
+                <small>{achievement['description']}</small><br>
+                <small>{" Unlocked" if is_unlocked else " Locked"} • {achievement['points']} pts</small>
+            </div>
+        """)
+    return "".join(items)
+
+# Classification chart spec, memoized on the (Type, Confidence, Recyclable, Hazard Level) rows
+@st.cache_data(max_entries=256, show_spinner=False)
+def classification_figure_json(analysis_rows):
+    df = pd.DataFrame(list(analysis_rows), columns=['Type', 'Confidence', 'Recyclable', 'Hazard Level'])
+    fig = px.bar(df, x='Type', y='Confidence',
+                title='Waste Classification Analysis',
+                color='Hazard Level',
+                color_discrete_map={'Low': '#4CAF50', 'Medium': '#FFA726', 'High': '#EF5350'})
+    
+    fig.update_layout(
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)',
+        title_font_size=16,
+        title_font_color='#2E7D32',
+        showlegend=True,
+        legend_title_text='Hazard Level',
+        xaxis_title="Waste Type",
+        yaxis_title="Confidence Score"
+    )
+    return fig.to_json()
+
+# Historical footprint chart spec and yearly total, generated once per process
+@st.cache_data(show_spinner=False)
+def historical_footprint_figure_json():
+    # Using month-end frequency for date range
+    dates = pd.date_range(start='2023-01-01', end='2023-12-31', freq='ME')
+    monthly_footprint = pd.Series(index=dates, data=np.random.normal(30, 5, len(dates)))
+    
+    fig = px.line(
+        x=dates,
+        y=monthly_footprint,
+        title='Your Carbon Footprint Over Time',
+        labels={'x': 'Month', 'y': 'Carbon Footprint (kg CO2e)'}
+    )
+    fig.update_layout(
+        showlegend=False,
+        hovermode='x',
+        plot_bgcolor='rgba(0,0,0,0)',
+        paper_bgcolor='rgba(0,0,0,0)'
+    )
+    return fig.to_json(), float(monthly_footprint.sum())
+
+# Custom CSS for enhanced UI, built once per process and emitted as a single block
+APP_CSS = """
     <style>
     /* Modern Color Scheme */
     :root {
@@ -313,8 +532,23 @@ st.markdown("""
         background-color: #CD7F32;
         color: #333;
     }
+    
+    /* Climate analysis tab */
+    .impact-number {
+        font-size: 24px;
+        font-weight: bold;
+        color: #2E7D32;
+        margin: 10px 0;
+    }
+    .result-card {
+        background-color: #f5f5f5;
+        padding: 20px;
+        border-radius: 10px;
+        margin: 10px 0;
+    }
     </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(APP_CSS, unsafe_allow_html=True)
 
 # Sidebar with User Profile and Achievements
 with st.sidebar:
@@ -329,24 +563,24 @@ with st.sidebar:
     with col1:
         st.markdown(f"""
             <div class='eco-card' style='text-align: center;'>
-                <h3 style='color: #2E7D32;'>Level {st.session_state.user_level}</h3>
-                <p> {st.session_state.user_points} pts</p>
+                <h3 style='color: #2E7D32;'>Level {st.session_state.progress.level}</h3>
+                <p> {st.session_state.progress.points} pts</p>
             </div>
         """, unsafe_allow_html=True)
     with col2:
         st.markdown(f"""
             <div class='eco-card' style='text-align: center;'>
                 <h3 style='color: #2E7D32;'>Rank</h3>
-                <p> {min(st.session_state.user_level * 10, 100)}</p>
+                <p> {min(st.session_state.progress.level * 10, 100)}</p>
             </div>
         """, unsafe_allow_html=True)
     
     # Progress to next level
-    points_to_next_level = (st.session_state.user_level * 200) - st.session_state.user_points
+    points_to_next_level = (st.session_state.progress.level * 200) - st.session_state.progress.points
     progress_percentage = ((200 - points_to_next_level) / 200) * 100
     st.markdown(f"""
         <div class='eco-card'>
-            <p style='margin-bottom: 0.5rem;'>Progress to Level {st.session_state.user_level + 1}</p>
+            <p style='margin-bottom: 0.5rem;'>Progress to Level {st.session_state.progress.level + 1}</p>
             <div class='progress-bar'>
                 <div class='progress-bar-fill' style='width: {progress_percentage}%;'></div>
             </div>
@@ -361,15 +595,9 @@ with st.sidebar:
         </div>
     """, unsafe_allow_html=True)
     
-    for achievement_id, achievement in ACHIEVEMENTS.items():
-        is_unlocked = achievement_id in st.session_state.achievements
-        st.markdown(f"""
-            <div class='achievement {"" if is_unlocked else "locked"}'>
-                <strong>{achievement['name']}</strong><br>
-                <small>{achievement['description']}</small><br>
-                <small>{" Unlocked" if is_unlocked else " Locked"} • {achievement['points']} pts</small>
-            </div>
-        """, unsafe_allow_html=True)
+    unlocked_ids = frozenset(st.session_state.progress.achievements)
+    st.markdown(render_achievements_panel(unlocked_ids), unsafe_allow_html=True)
+
 
 # Main Content Area
 st.markdown("""
@@ -425,95 +653,127 @@ with tab1:
             try:
                 g = geocoder.ip('me')
                 if g.latlng:
-                    st.session_state['lat'], st.session_state['lon'] = g.latlng
-                    geolocator = Nominatim(user_agent="waste_analyzer")
-                    location = geolocator.reverse((st.session_state['lat'], st.session_state['lon']))
-                    location_input = location.address
+                    location_input = reverse_geocode(*g.latlng)
                     st.success(" Location detected! +5 points")
                     update_points_and_achievements('location_search')
             except Exception as e:
                 st.error(" Mission Update: Could not detect location. Please enter manually.")
         
-        analyze_button = st.button(" Complete Mission")
+        # Collect a finished mission job before drawing the button, which stays
+        # disabled while a mission is still pending
+        suggestions = None
+        mission_location = location_input
+        mission_pending = False
+        if job_queue and 'mission_job' in st.session_state:
+            job_id, mission_location, submitted_at = st.session_state.mission_job
+            suggestions = poll_job(job_id, submitted_at)
+            if suggestions is None:
+                mission_pending = True
+            else:
+                del st.session_state.mission_job
+        
+        analyze_button = st.button(" Complete Mission", disabled=mission_pending)
         st.markdown("</div>", unsafe_allow_html=True)
         
-        if analyze_button and user_input:
+        if analyze_button and user_input and not mission_pending:
             update_points_and_achievements('analysis')
-            with st.spinner(" Mission in progress..."):
-                # Generate suggestions
-                suggestions = generate_suggestions(user_input)
-                
-                # Display suggestions with enhanced UI
-                st.markdown(f"""
-                    <div class='eco-card'>
-                        <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'> Mission Accomplished!</h4>
-                        <p style='color: #1B5E20; margin-bottom: 1rem;'>{suggestions}</p>
-                        <p style='color: #666;'>+20 points awarded for completing the analysis!</p>
-                    </div>
-                """, unsafe_allow_html=True)
-                
-                # If location is provided, show nearby disposal locations
-                if location_input:
-                    try:
-                        geolocator = Nominatim(user_agent="waste_analyzer")
-                        location = geolocator.geocode(location_input)
-                        if location:
-                            st.markdown("""
-                                <div class='eco-card'>
-                                    <h4 style='color: #2E7D32; margin-bottom: 1rem;'> Disposal Locations Found!</h4>
-                                </div>
-                            """, unsafe_allow_html=True)
-                            
-                            # Create a map with modern styling
-                            m = folium.Map(
-                                location=[location.latitude, location.longitude],
-                                zoom_start=13,
-                                tiles='CartoDB positron'
-                            )
-                            
-                            # Add user location marker
+            if job_queue:
+                cache_key = analysis.suggestions_cache_key(user_input, structured_output=STRUCTURED_OUTPUT)
+                suggestions = shared_state.get(cache_key)
+                mission_location = location_input
+                if suggestions is None:
+                    # Hand the model call to a worker; the result is picked up on a later rerun
+                    previous_job = st.session_state.pop('mission_job', None)
+                    if previous_job:
+                        job_queue.delete(previous_job[0])
+                    job_id = job_queue.submit('generate_suggestions', {
+                        'prompt': user_input,
+                        'structured_output': STRUCTURED_OUTPUT,
+                        'cache_key': cache_key
+                    })
+                    st.session_state.mission_job = (job_id, location_input, time.time())
+                    mission_pending = True
+            else:
+                with st.spinner(" Mission in progress..."):
+                    # Generate suggestions
+                    suggestions = generate_suggestions(user_input)
+        
+        if mission_pending:
+            job_id, _, submitted_at = st.session_state.mission_job
+            job_waiting_panel(job_id, submitted_at, " Mission in progress... your suggestions will appear here when ready.")
+        
+        if suggestions is not None:
+            # Display suggestions with enhanced UI
+            st.markdown(f"""
+                <div class='eco-card'>
+                    <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'> Mission Accomplished!</h4>
+                    <div style='color: #1B5E20; margin-bottom: 1rem;'>{format_suggestions(suggestions)}</div>
+                    <p style='color: #666;'>+20 points awarded for completing the analysis!</p>
+                </div>
+            """, unsafe_allow_html=True)
+            
+            # If location is provided, show nearby disposal locations
+            if mission_location:
+                try:
+                    coords = geocode_address(mission_location)
+                    if coords:
+                        lat, lon = coords
+                        st.markdown("""
+                            <div class='eco-card'>
+                                <h4 style='color: #2E7D32; margin-bottom: 1rem;'> Disposal Locations Found!</h4>
+                            </div>
+                        """, unsafe_allow_html=True)
+                        
+                        # Create a map with modern styling
+                        m = folium.Map(
+                            location=[lat, lon],
+                            zoom_start=13,
+                            tiles='CartoDB positron'
+                        )
+                        
+                        # Add user location marker
+                        folium.Marker(
+                            [lat, lon],
+                            popup="Your Location",
+                            icon=folium.Icon(color='red', icon='info-sign')
+                        ).add_to(m)
+                        
+                        # Get and display nearby locations
+                        nearby_locations = get_nearby_disposal_locations(lat, lon, "General")
+                        for loc in nearby_locations:
                             folium.Marker(
-                                [location.latitude, location.longitude],
-                                popup="Your Location",
-                                icon=folium.Icon(color='red', icon='info-sign')
+                                [loc["lat"], loc["lon"]],
+                                popup=loc["name"],
+                                icon=folium.Icon(color='green')
                             ).add_to(m)
-                            
-                            # Get and display nearby locations
-                            nearby_locations = get_nearby_disposal_locations(location.latitude, location.longitude, "General")
-                            for loc in nearby_locations:
-                                folium.Marker(
-                                    [loc["lat"], loc["lon"]],
-                                    popup=loc["name"],
-                                    icon=folium.Icon(color='green')
-                                ).add_to(m)
-                            
-                            # Display the map in a card
-                            st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
-                            components.html(m._repr_html_(), height=400)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                            
-                            # List the locations with enhanced UI
-                            st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
-                            for i, loc in enumerate(nearby_locations, 1):
-                                distance = geodesic(
-                                    (location.latitude, location.longitude),
-                                    (loc["lat"], loc["lon"])
-                                ).miles
-                                st.markdown(f"""
-                                    <div style='background-color: #F5F5F5; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem;'>
-                                        <strong> {loc['name']}</strong><br>
-                                        <small> Distance: {distance:.1f} miles</small>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                            st.markdown("</div>", unsafe_allow_html=True)
-                            
-                            update_points_and_achievements('location_search')
-                            st.success(" Bonus Mission Complete: +15 points for finding disposal locations!")
-                        else:
-                            st.error(" Location not found. Please try a different address.")
-                    except Exception as e:
-                        st.error(f" Error finding disposal locations: {str(e)}")
-                        st.error("Please try a different location or try again later.")
+                        
+                        # Display the map in a card
+                        st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
+                        components.html(m._repr_html_(), height=400)
+                        st.markdown("</div>", unsafe_allow_html=True)
+                        
+                        # List the locations with enhanced UI
+                        st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
+                        for i, loc in enumerate(nearby_locations, 1):
+                            distance = geodesic(
+                                (lat, lon),
+                                (loc["lat"], loc["lon"])
+                            ).miles
+                            st.markdown(f"""
+                                <div style='background-color: #F5F5F5; padding: 0.8rem; border-radius: 8px; margin-bottom: 0.5rem;'>
+                                    <strong> {loc['name']}</strong><br>
+                                    <small> Distance: {distance:.1f} miles</small>
+                                </div>
+                            """, unsafe_allow_html=True)
+                        st.markdown("</div>", unsafe_allow_html=True)
+                        
+                        update_points_and_achievements('location_search')
+                        st.success(" Bonus Mission Complete: +15 points for finding disposal locations!")
+                    else:
+                        st.error(" Location not found. Please try a different address.")
+                except Exception as e:
+                    st.error(f" Error finding disposal locations: {str(e)}")
+                    st.error("Please try a different location or try again later.")
 
 with tab2:
     st.markdown("""
@@ -549,138 +809,137 @@ with tab2:
         # Display image and analysis in result column
         with result_col:
             st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
-            image = Image.open(uploaded_file)
-            st.image(image, caption="Analyzing...", use_container_width=True)
-            
-            # Analyze image using Gemini Pro Vision model
-            with st.spinner("Analyzing image content..."):
+            # The downscaled copy is what gets displayed, so the full-resolution upload
+            # never reaches the media store. It is only kept in the session until the
+            # analysis is done; after that it is rebuilt for display on each run.
+            preview = st.session_state.get('image_preview')
+            if not preview or preview[0] != uploaded_file.file_id:
                 try:
-                    caption = analyze_image(image)
-                    # Clean up repetitive text
-                    caption = clean_caption(caption)
-                    st.markdown(f"""
-                        <div style='background-color: #E8F5E9; padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
-                            <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'> Image Analysis</h4>
-                            <p style='color: #1B5E20; margin-bottom: 0;'>{caption}</p>
-                        </div>
-                    """, unsafe_allow_html=True)
+                    preview = (uploaded_file.file_id, prepare_image(uploaded_file))
                 except Exception as e:
-                    st.error("Error analyzing the image. Please try again.")
+                    st.error("Error reading the image. Please upload a different file.")
                     st.error(f"Error details: {str(e)}")
-                    caption = ""
-            st.markdown("</div>", unsafe_allow_html=True)
-            
-            # Analysis results in a separate card below
-            st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
-            st.markdown("<h4 style='color: #2E7D32; margin-bottom: 1rem;'>Analysis Results</h4>", unsafe_allow_html=True)
+                    preview = (uploaded_file.file_id, None)
+                st.session_state.image_preview = preview
+            image_bytes = preview[1]
+            if image_bytes:
+                st.image(image_bytes, caption="Analyzing...", use_container_width=True)
             
-            # Initialize waste types with default values if no caption is available
-            if not caption:
-                waste_types = {
-                    "Plastic": {"confidence": 0.2, "recyclable": True, "hazard_level": "Medium"},
-                    "Paper": {"confidence": 0.2, "recyclable": True, "hazard_level": "Low"},
-                    "Metal": {"confidence": 0.2, "recyclable": True, "hazard_level": "Low"},
-                    "Glass": {"confidence": 0.2, "recyclable": True, "hazard_level": "Medium"},
-                    "Organic": {"confidence": 0.2, "recyclable": True, "hazard_level": "Low"}
-                }
+            # Only the result for the latest upload is kept; the image is analyzed once
+            cached_analysis = st.session_state.get('image_analysis')
+            pending_job = st.session_state.get('image_job')
+            image_result = None
+            if cached_analysis and cached_analysis[0] == uploaded_file.file_id:
+                image_result = cached_analysis[1]
+            elif job_queue and pending_job and pending_job[0] == uploaded_file.file_id:
+                image_result = poll_job(pending_job[1], pending_job[2])
+                if image_result is not None:
+                    st.session_state.image_analysis = (uploaded_file.file_id, image_result)
+                    del st.session_state.image_job
+            elif image_bytes is None:
+                image_result = {"raw": "", "structured": None}
             else:
-                # Use the caption to determine waste type probabilities
-                waste_types = {
-                    "Plastic": {"confidence": 0.0, "recyclable": True, "hazard_level": "Medium"},
-                    "Paper": {"confidence": 0.0, "recyclable": True, "hazard_level": "Low"},
-                    "Metal": {"confidence": 0.0, "recyclable": True, "hazard_level": "Low"},
-                    "Glass": {"confidence": 0.0, "recyclable": True, "hazard_level": "Medium"},
-                    "Organic": {"confidence": 0.0, "recyclable": True, "hazard_level": "Low"}
-                }
+                # Analyze image using Gemini Pro Vision model
+                with st.spinner("Analyzing image content..."):
+                    try:
+                        if job_queue:
+                            # A newer upload replaces whatever the session was waiting on
+                            if pending_job:
+                                job_queue.delete(pending_job[1])
+                            cache_key = analysis.image_cache_key(image_bytes, structured_output=STRUCTURED_OUTPUT)
+                            image_result = shared_state.get(cache_key)
+                            if image_result is None:
+                                job_id = job_queue.submit(
+                                    'analyze_image',
+                                    {'structured_output': STRUCTURED_OUTPUT, 'cache_key': cache_key},
+                                    blob=image_bytes
+                                )
+                                st.session_state.image_job = (uploaded_file.file_id, job_id, time.time())
+                        else:
+                            image_result = analyze_image(image_bytes)
+                        if image_result is not None:
+                            st.session_state.image_analysis = (uploaded_file.file_id, image_result)
+                    except Exception as e:
+                        st.error("Error analyzing the image. Please try again.")
+                        st.error(f"Error details: {str(e)}")
+                        image_result = {"raw": "", "structured": None}
+            cached_analysis = st.session_state.get('image_analysis')
+            if cached_analysis and cached_analysis[0] == uploaded_file.file_id:
+                # Release the image buffer once its analysis is cached
+                st.session_state.pop('image_preview', None)
+            if image_result is None:
+                _, job_id, submitted_at = st.session_state.image_job
+                job_waiting_panel(job_id, submitted_at, "Image queued for analysis... results will appear here when ready.")
+            elif image_result['raw']:
+                # Normalized text when the caption parsed, otherwise the error message.
+                # Both come from the model or its error, so they are escaped like the suggestions.
+                caption = html.escape(image_result['structured']['summary'] if image_result['structured'] else image_result['raw'])
+                st.markdown(f"""
+                    <div style='background-color: #E8F5E9; padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
+                        <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'> Image Analysis</h4>
+                        <p style='color: #1B5E20; margin-bottom: 0;'>{caption}</p>
+                    </div>
+                """, unsafe_allow_html=True)
+            st.markdown("</div>", unsafe_allow_html=True)
+            
+            # Results are shown once the analysis is available
+            if image_result is not None:
+                # Analysis results in a separate card below
+                st.markdown("<div class='eco-card'>", unsafe_allow_html=True)
+                st.markdown("<h4 style='color: #2E7D32; margin-bottom: 1rem;'>Analysis Results</h4>", unsafe_allow_html=True)
                 
-                # Simple keyword matching to adjust confidence scores
-                caption_lower = caption.lower()
-                keywords = {
-                    "Plastic": ["plastic", "bottle", "container", "packaging"],
-                    "Paper": ["paper", "cardboard", "box", "newspaper"],
-                    "Metal": ["metal", "can", "aluminum", "steel"],
-                    "Glass": ["glass", "bottle", "jar"],
-                    "Organic": ["food", "waste", "organic", "vegetable", "fruit"]
-                }
+                # Structured fields were extracted once when the caption arrived
+                structured = image_result['structured'] or default_structured_result()
+                waste_types = structured['waste_types']
                 
-                # Calculate confidence scores based on keywords
-                for waste_type, related_words in keywords.items():
-                    confidence = sum([1 for word in related_words if word in caption_lower]) / len(related_words)
-                    waste_types[waste_type]["confidence"] = min(confidence, 0.95)  # Cap at 95% confidence
+                # Display key metrics in a grid
+                metric_col1, metric_col2, metric_col3 = st.columns(3)
+                
+                primary_type = structured['primary_type']
+                
+                with metric_col1:
+                    st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+                    st.metric("Primary Type", primary_type)
+                    st.markdown("</div>", unsafe_allow_html=True)
+                
+                with metric_col2:
+                    st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+                    st.metric("Confidence", f"{waste_types[primary_type]['confidence']:.1%}")
+                    st.markdown("</div>", unsafe_allow_html=True)
+                
+                with metric_col3:
+                    st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
+                    st.metric("Hazard Level", structured['hazard_level'])
+                    st.markdown("</div>", unsafe_allow_html=True)
+                
+                # Create detailed analysis chart
+                st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
+                analysis_rows = tuple(
+                    (waste_type, details['confidence'], 'Yes' if details['recyclable'] else 'No', details['hazard_level'])
+                    for waste_type, details in waste_types.items()
+                )
+                fig = json.loads(classification_figure_json(analysis_rows))
+                
+                st.plotly_chart(fig, use_container_width=True)
+                
+                # Recommendations section, using the disposal steps found in the analysis
+                recommendations = structured['disposal_steps'] or DEFAULT_RECOMMENDATIONS
+                recommendation_items = "".join(f"<li>{html.escape(step)}</li>" for step in recommendations)
+                st.markdown(f"""
+                    <div style='background-color: #f8f9fa; padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
+                        <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'> Recommendations</h4>
+                        <ul style='margin-bottom: 0;'>{recommendation_items}</ul>
+                    </div>
+                """, unsafe_allow_html=True)
                 
-                # Normalize confidence scores
-                total_confidence = sum(type_info["confidence"] for type_info in waste_types.values())
-                if total_confidence > 0:
-                    for waste_type in waste_types:
-                        waste_types[waste_type]["confidence"] /= total_confidence
-                else:
-                    # If no matches, set a small baseline confidence for each type
-                    for waste_type in waste_types:
-                        waste_types[waste_type]["confidence"] = 0.2
-            
-            # Display key metrics in a grid
-            metric_col1, metric_col2, metric_col3 = st.columns(3)
-            
-            top_waste = max(waste_types.items(), key=lambda x: x[1]['confidence'])
-            
-            with metric_col1:
-                st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-                st.metric("Primary Type", top_waste[0])
-                st.markdown("</div>", unsafe_allow_html=True)
-            
-            with metric_col2:
-                st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-                st.metric("Confidence", f"{top_waste[1]['confidence']:.1%}")
-                st.markdown("</div>", unsafe_allow_html=True)
-            
-            with metric_col3:
-                st.markdown("<div class='metric-container'>", unsafe_allow_html=True)
-                st.metric("Hazard Level", top_waste[1]['hazard_level'])
                 st.markdown("</div>", unsafe_allow_html=True)
-            
-            # Create detailed analysis chart
-            st.markdown("<div class='chart-container'>", unsafe_allow_html=True)
-            analysis_data = []
-            for waste_type, details in waste_types.items():
-                analysis_data.append({
-                    'Type': waste_type,
-                    'Confidence': details['confidence'],
-                    'Recyclable': 'Yes' if details['recyclable'] else 'No',
-                    'Hazard Level': details['hazard_level']
-                })
-            
-            df = pd.DataFrame(analysis_data)
-            fig = px.bar(df, x='Type', y='Confidence',
-                        title='Waste Classification Analysis',
-                        color='Hazard Level',
-                        color_discrete_map={'Low': '#4CAF50', 'Medium': '#FFA726', 'High': '#EF5350'})
-            
-            fig.update_layout(
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                title_font_size=16,
-                title_font_color='#2E7D32',
-                showlegend=True,
-                legend_title_text='Hazard Level',
-                xaxis_title="Waste Type",
-                yaxis_title="Confidence Score"
-            )
-            
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # Recommendations section
-            st.markdown("""
-                <div style='background-color: #f8f9fa; padding: 1rem; border-radius: 8px; margin-top: 1rem;'>
-                    <h4 style='color: #2E7D32; margin-bottom: 0.5rem;'> Recommendations</h4>
-                    <ul style='margin-bottom: 0;'>
-                        <li>Ensure proper segregation before disposal</li>
-                        <li>Check local recycling guidelines</li>
-                        <li>Consider reuse options if applicable</li>
-                    </ul>
-                </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown("</div>", unsafe_allow_html=True)
+    else:
+        # The upload was cleared: drop its image and result, and any analysis still pending
+        st.session_state.pop('image_preview', None)
+        st.session_state.pop('image_analysis', None)
+        if job_queue and 'image_job' in st.session_state:
+            job_queue.delete(st.session_state.image_job[1])
+            del st.session_state.image_job
 
 with tab3:
     st.markdown("""
@@ -730,26 +989,10 @@ with tab3:
     with col2:
         st.subheader("Historical Impact")
         
-        # Using month-end frequency for date range
-        dates = pd.date_range(start='2023-01-01', end='2023-12-31', freq='ME')
-        monthly_footprint = pd.Series(index=dates, data=np.random.normal(30, 5, len(dates)))
-        
-        fig = px.line(
-            x=dates,
-            y=monthly_footprint,
-            title='Your Carbon Footprint Over Time',
-            labels={'x': 'Month', 'y': 'Carbon Footprint (kg CO2e)'}
-        )
-        fig.update_layout(
-            showlegend=False,
-            hovermode='x',
-            plot_bgcolor='rgba(0,0,0,0)',
-            paper_bgcolor='rgba(0,0,0,0)'
-        )
-        st.plotly_chart(fig)
+        fig_json, total_impact = historical_footprint_figure_json()
+        st.plotly_chart(json.loads(fig_json))
         
         # Display total impact
-        total_impact = monthly_footprint.sum()
         st.markdown(f"""
             <div class='eco-card'>
                 <h4>Total Impact This Year</h4>
@@ -758,20 +1001,13 @@ with tab3:
             </div>
         """, unsafe_allow_html=True)
 
-# Add custom CSS for climate analysis tab
-st.markdown("""
-    <style>
-    .impact-number {
-        font-size: 24px;
-        font-weight: bold;
-        color: #2E7D32;
-        margin: 10px 0;
-    }
-    .result-card {
-        background-color: #f5f5f5;
-        padding: 20px;
-        border-radius: 10px;
-        margin: 10px 0;
-    }
-    </style>
-""", unsafe_allow_html=True)
\ No newline at end of file
+# Per-session memory usage, for capacity planning. Measured at the end of the
+# script so that the first run of a session records a real idle session.
+if os.getenv('ECOQUEST_MEMORY_REPORT'):
+    if 'idle_session_bytes' not in st.session_state:
+        st.session_state.idle_session_bytes = session_state_bytes()
+    with st.sidebar:
+        with st.expander("Session memory"):
+            report = session_memory_report()
+            st.metric("Idle session", f"{report['idle_session_bytes']:,} bytes")
+            st.metric("Active session", f"{report['active_session_bytes']:,} bytes")
@@ -0,0 +1,273 @@
+import os
+import sys
+import json
+import time
+import uuid
+import sqlite3
+import signal
+import threading
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+import analysis
+from state_backend import get_state_backend
+
+# Durable SQLite-backed queue for slow model calls.
+# The Streamlit app submits jobs and polls for their results; worker
+# processes started with `python job_queue.py --workers N` execute them.
+
+# Used when neither --db nor ECOQUEST_QUEUE_DB is given
+DEFAULT_DB_PATH = 'ecoquest_jobs.db'
+
+# Seconds a running job may go without a lease renewal before another worker
+# reclaims it. Workers renew the lease while they run a job, so only a job whose
+# worker died expires.
+JOB_LEASE_SECONDS = 20
+LEASE_RENEW_INTERVAL = 5
+MAX_ATTEMPTS = 3
+
+# Seconds the app waits for a job before reporting an error. Longer than every
+# attempt's lease together, so a job is retried after each worker crash while a
+# session is still waiting on it.
+JOB_TIMEOUT = 120
+
+# Sessions stop waiting long before this, so older jobs of any status are abandoned
+JOB_RETENTION_SECONDS = 60 * 60
+# Seconds between purges of abandoned jobs in each worker
+PURGE_INTERVAL = 60
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        blob BLOB,
+        status TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+"""
+
+class JobQueue:
+    def __init__(self, path=None):
+        self.path = path or os.getenv('ECOQUEST_QUEUE_DB', DEFAULT_DB_PATH)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    # A short-lived connection per call keeps the queue safe to use from
+    # Streamlit's script threads and from several worker processes
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def submit(self, kind, payload, blob=None):
+        job_id = str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, payload, blob, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), blob, now, now)
+            )
+        return job_id
+
+    # Status, result and error of a job, or None if it does not exist
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, kind, status, result, error FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+    # Atomically take the oldest runnable job, including ones whose worker died
+    def claim(self):
+        with self._connect() as conn:
+            while True:
+                now = time.time()
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(
+                        "SELECT * FROM jobs WHERE (status = 'queued' OR (status = 'running' AND updated_at < ?)) "
+                        "ORDER BY created_at LIMIT 1",
+                        (now - JOB_LEASE_SECONDS,)
+                    ).fetchone()
+                    if row is not None and row['attempts'] >= MAX_ATTEMPTS:
+                        conn.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, blob = NULL, updated_at = ? WHERE id = ?",
+                            ("Job abandoned after repeated worker failures", now, row['id'])
+                        )
+                    elif row is not None:
+                        conn.execute(
+                            "UPDATE jobs SET status = 'running', attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                            (now, row['id'])
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                if row is None:
+                    return None
+                if row['attempts'] < MAX_ATTEMPTS:
+                    break
+        job = dict(row)
+        job['attempts'] += 1
+        job['payload'] = json.loads(job['payload'])
+        return job
+
+    # Extend the lease of a job this worker is still running
+    def renew(self, job_id):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = 'running'",
+                (time.time(), job_id)
+            )
+
+    def complete(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, blob = NULL, updated_at = ? WHERE id = ?",
+                (json.dumps(result), time.time(), job_id)
+            )
+
+    def fail(self, job_id, error):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, blob = NULL, updated_at = ? WHERE id = ?",
+                (error, time.time(), job_id)
+            )
+
+    # Forget a job once its result has been delivered to the session
+    def delete(self, job_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    # Drop results nobody collected and queued jobs nobody is waiting for any more
+    def purge(self, max_age=JOB_RETENTION_SECONDS):
+        cutoff = time.time() - max_age
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE (status IN ('done', 'failed') AND updated_at < ?) "
+                "OR (status IN ('queued', 'running') AND created_at < ?)",
+                (cutoff, cutoff)
+            )
+        return cursor.rowcount
+
+def run_analyze_image(models, payload, blob):
+    _, vision_model = models
+    return analysis.describe_image(
+        vision_model, blob,
+        payload.get('prompt', analysis.DEFAULT_IMAGE_PROMPT),
+        payload.get('structured_output', False)
+    )
+
+def run_generate_suggestions(models, payload, blob):
+    text_model, _ = models
+    return analysis.generate_suggestions(
+        text_model, payload['prompt'], payload.get('waste_type'), payload.get('structured_output', False)
+    )
+
+JOB_HANDLERS = {
+    'analyze_image': run_analyze_image,
+    'generate_suggestions': run_generate_suggestions
+}
+
+# Renew a job's lease until stop is set
+def renew_lease(queue, job_id, stop):
+    while not stop.wait(LEASE_RENEW_INTERVAL):
+        queue.renew(job_id)
+
+# Models for free-text or structured jobs, loaded the first time a job needs them.
+# Each job says which mode it wants, so workers need no setting of their own.
+class ModelLoader:
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.models = {}
+
+    # Raises ValueError if structured output is requested from models that do not support it
+    def get(self, structured_output):
+        if structured_output not in self.models:
+            self.models[structured_output] = (
+                analysis.load_gemini_models(self.api_key, structured_output) if self.api_key else (None, None)
+            )
+        return self.models[structured_output]
+
+# Worker process: load models as jobs need them, then drain the queue forever,
+# purging abandoned jobs every PURGE_INTERVAL seconds
+def run_worker(db_path, poll_interval):
+    load_dotenv()
+    models = ModelLoader(os.getenv('GOOGLE_API_KEY'))
+    queue = JobQueue(db_path)
+    state = get_state_backend()
+    last_purge = 0
+    while True:
+        if time.time() - last_purge > PURGE_INTERVAL:
+            queue.purge()
+            last_purge = time.time()
+        job = queue.claim()
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=renew_lease, args=(queue, job['id'], stop), daemon=True)
+        heartbeat.start()
+        try:
+            handler = JOB_HANDLERS[job['kind']]
+            result = handler(models.get(job['payload'].get('structured_output', False)), job['payload'], job['blob'])
+            # Share the result with every app process that asks the same question
+            cache_key = job['payload'].get('cache_key')
+            if cache_key and not analysis.is_error_response(result):
+                state.set(cache_key, result, ttl=analysis.MODEL_CACHE_TTL)
+            queue.complete(job['id'], result)
+        except Exception as e:
+            queue.fail(job['id'], f"{type(e).__name__}: {str(e)}")
+        finally:
+            stop.set()
+            heartbeat.join()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run EcoQuest background analysis workers")
+    parser.add_argument('--workers', type=int, default=2, help="Number of worker processes")
+    parser.add_argument('--db', default=None, help="Path to the SQLite queue database (default: ECOQUEST_QUEUE_DB or ecoquest_jobs.db)")
+    parser.add_argument('--poll-interval', type=float, default=0.5, help="Seconds to wait when the queue is empty")
+    args = parser.parse_args(argv)
+    load_dotenv()
+
+    # Create the schema before the workers race to do it
+    db_path = JobQueue(args.db).path
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(db_path, args.poll_interval), daemon=True)
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    # Stop the workers too when the supervisor is terminated by a process manager
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
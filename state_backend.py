@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import random
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+# Shared key/value state for user progress and caches, so that several
+# Streamlit processes (on one node or many) behind a load balancer see the
+# same data. Values are stored as JSON.
+#
+# ECOQUEST_STATE_URL selects the backend:
+#   sqlite:///path/to/state.db  local file, shared by processes on one node (default)
+#   redis://host:6379/0         networked, shared across nodes (needs the redis package)
+
+DEFAULT_STATE_URL = 'sqlite:///ecoquest_state.db'
+
+# Share of SQLite writes that also delete every expired row
+PURGE_PROBABILITY = 0.01
+
+class StateBackend(ABC):
+    # Stored value for key, or None if missing or expired
+    @abstractmethod
+    def get(self, key):
+        ...
+
+    # Store a JSON-serializable value, optionally expiring after ttl seconds
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        ...
+
+    @abstractmethod
+    def delete(self, key):
+        ...
+
+    # Atomically replace the value for key with func(current value or None) and
+    # return the new value. func may be called more than once, so it must not
+    # have side effects.
+    @abstractmethod
+    def update(self, key, func, ttl=None):
+        ...
+
+class SQLiteStateBackend(StateBackend):
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] < time.time():
+                conn.execute("DELETE FROM state WHERE key = ? AND expires_at < ?", (key, time.time()))
+                return None
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.time() + ttl if ttl else None
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires_at)
+            )
+        # Expired entries that are never read again would otherwise stay forever
+        if random.random() < PURGE_PROBABILITY:
+            self.purge()
+
+    # Delete every expired entry, returning how many were removed
+    def purge(self):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM state WHERE expires_at < ?", (time.time(),)).rowcount
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def update(self, key, func, ttl=None):
+        with self._connect() as conn:
+            # Take the write lock before reading so concurrent updates serialize
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute("SELECT value, expires_at FROM state WHERE key = ?", (key,)).fetchone()
+                current = json.loads(row[0]) if row is not None and (row[1] is None or row[1] >= now) else None
+                value = func(current)
+                conn.execute(
+                    "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value), now + ttl if ttl else None)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return value
+
+# Works with any client exposing redis-py's get/set/delete and pipeline, so a
+# local stand-in (e.g. fakeredis) can replace the real server
+class RedisStateBackend(StateBackend):
+    def __init__(self, client, prefix='ecoquest:'):
+        self.client = client
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis package is required for redis:// state URLs. Install it with: pip install redis")
+        return cls(redis.Redis.from_url(url))
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    # Optimistic WATCH/MULTI transaction, retried if another client wrote the key first
+    def update(self, key, func, ttl=None):
+        from redis.exceptions import WatchError
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(self.prefix + key)
+                    stored = pipe.get(self.prefix + key)
+                    value = func(json.loads(stored) if stored is not None else None)
+                    pipe.multi()
+                    pipe.set(self.prefix + key, json.dumps(value), ex=int(ttl) if ttl else None)
+                    pipe.execute()
+                    return value
+                except WatchError:
+                    continue
+
+def get_state_backend(url=None):
+    url = url or os.getenv('ECOQUEST_STATE_URL', DEFAULT_STATE_URL)
+    if url.startswith('sqlite:///'):
+        return SQLiteStateBackend(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStateBackend.from_url(url)
+    raise ValueError(f"Unsupported state backend URL: {url}")
@@ -0,0 +1,126 @@
+import copy
+
+import pytest
+
+from captions import process_caption, structured_from_json
+
+
+def confidences(text):
+    return {waste_type: details["confidence"] for waste_type, details in process_caption(text)["waste_types"].items()}
+
+
+def test_plural_keywords_match():
+    assert process_caption("Glass jars and food waste.")["primary_type"] == "Glass"
+    assert confidences("Two plastic bottles.") == confidences("Two plastic bottle.")
+    assert confidences("Boxes.")["Paper"] == 1
+    assert confidences("Containers.")["Plastic"] == 1
+    assert confidences("Fruits.")["Organic"] == 1
+
+
+def test_modal_can_is_not_metal():
+    assert confidences("This plastic bottle can be recycled.")["Metal"] == 0
+    assert confidences("You can't put paper in the bin.")["Metal"] == 0
+    assert confidences("Can you recycle glass?")["Metal"] == 0
+
+
+def test_can_as_container_is_metal():
+    assert process_caption("An empty soda can.")["primary_type"] == "Metal"
+    assert process_caption("A pile of cans.")["primary_type"] == "Metal"
+
+
+def test_repeated_sentences_are_dropped():
+    result = process_caption("This is a plastic bottle. This is a plastic bottle. It is light.")
+    assert result["summary"] == "This is a plastic bottle. It is light."
+
+
+def test_ngram_loops_are_collapsed():
+    result = process_caption("It is recyclable recyclable recyclable. Rinse it out rinse it out rinse it out.")
+    assert result["summary"] == "It is recyclable. Rinse it out."
+    assert result["recyclable"] is True
+
+
+def test_disposal_steps_come_from_disposal_lines():
+    caption = (
+        "This is a PET bottle.\n"
+        "* **Material:** PET plastic\n"
+        "* **Color:** Clear\n"
+        "**How to dispose of it:**\n"
+        "1. Empty the bottle.\n"
+        "2. Squash it flat.\n"
+        "## Notes\n"
+        "- It is lightweight.\n"
+        "Take it to a recycling bin."
+    )
+    assert process_caption(caption)["disposal_steps"] == [
+        "Empty the bottle.", "Squash it flat.", "Take it to a recycling bin."
+    ]
+
+
+def test_disposal_steps_are_capped():
+    caption = "\n".join(f"{number}. Rinse item {number}." for number in range(1, 9))
+    assert len(process_caption(caption)["disposal_steps"]) == 5
+
+
+VALID_REPLY = {
+    "summary": "A clear plastic bottle.",
+    "waste_types": [
+        {"type": "Plastic", "confidence": 0.9, "recyclable": True, "hazard_level": "Low"},
+        {"type": "Paper", "confidence": 0.1, "recyclable": True, "hazard_level": "Low"}
+    ],
+    "recyclable": True,
+    "hazard_level": "Low",
+    "disposal_steps": ["Rinse it.", "Put it in the recycling bin."]
+}
+
+
+def test_structured_reply_is_parsed():
+    result = structured_from_json(VALID_REPLY)
+    assert result["primary_type"] == "Plastic"
+    assert result["waste_types"]["Plastic"]["confidence"] == pytest.approx(0.9)
+    assert result["waste_types"]["Glass"]["confidence"] == 0
+    assert result["disposal_steps"] == ["Rinse it.", "Put it in the recycling bin."]
+
+
+@pytest.mark.parametrize("field, value", [
+    ("summary", 42),
+    ("waste_types", {"type": "Plastic"}),
+    ("waste_types", ["Plastic"]),
+    ("waste_types", [{"type": "Wood", "confidence": 1, "recyclable": True, "hazard_level": "Low"}]),
+    ("waste_types", [{"type": "Plastic", "confidence": True, "recyclable": True, "hazard_level": "Low"}]),
+    ("waste_types", [{"type": "Plastic", "confidence": 0.5, "recyclable": "yes", "hazard_level": "Low"}]),
+    ("waste_types", [{"type": "Plastic", "confidence": 0.5, "recyclable": True}]),
+    ("recyclable", "false"),
+    ("hazard_level", "Extreme"),
+    ("disposal_steps", "Rinse it."),
+    ("disposal_steps", [1, 2]),
+])
+def test_malformed_structured_reply_is_rejected(field, value):
+    reply = copy.deepcopy(VALID_REPLY)
+    reply[field] = value
+    with pytest.raises(ValueError):
+        structured_from_json(reply)
+
+
+def test_structured_reply_missing_field_is_rejected():
+    reply = copy.deepcopy(VALID_REPLY)
+    del reply["disposal_steps"]
+    with pytest.raises(ValueError):
+        structured_from_json(reply)
+    with pytest.raises(ValueError):
+        structured_from_json(["not", "an", "object"])
+
+
+def test_facts_using_step_verbs_are_not_steps():
+    caption = (
+        "Plastic bottles can take up to 450 years to decompose in a landfill. "
+        "Caps are often made of a different plastic, so remove them first. "
+        "Rinse the bottle. Drop it off at a recycling point."
+    )
+    assert process_caption(caption)["disposal_steps"] == [
+        "Rinse the bottle.", "Drop it off at a recycling point."
+    ]
+
+
+def test_legitimate_doubled_words_are_kept():
+    assert process_caption("I had had enough. Bye bye.")["summary"] == "I had had enough. Bye bye."
+    assert process_caption("It is very very very dirty.")["summary"] == "It is very dirty."
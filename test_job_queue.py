@@ -0,0 +1,157 @@
+import threading
+import time
+
+import pytest
+
+import job_queue
+from job_queue import JobQueue, JOB_LEASE_SECONDS, JOB_TIMEOUT, MAX_ATTEMPTS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(job_queue.time, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return JobQueue(str(tmp_path / "jobs.db"))
+
+
+def test_crashed_job_is_reclaimed_before_session_timeout(queue, clock):
+    submitted_at = clock.now
+    job_id = queue.submit("generate_suggestions", {"prompt": "plastic bottle"})
+    assert queue.claim()["id"] == job_id
+
+    # The worker dies: its lease is never renewed
+    clock.now += JOB_LEASE_SECONDS - 1
+    assert queue.claim() is None
+    clock.now += 2
+    reclaimed = queue.claim()
+    assert reclaimed["id"] == job_id
+    assert reclaimed["attempts"] == 2
+    assert clock.now - submitted_at < JOB_TIMEOUT
+
+
+def test_every_attempt_fits_in_the_session_timeout():
+    assert JOB_LEASE_SECONDS * MAX_ATTEMPTS < JOB_TIMEOUT
+
+
+def test_renewed_lease_is_not_reclaimed(queue, clock):
+    job_id = queue.submit("generate_suggestions", {"prompt": "plastic bottle"})
+    queue.claim()
+    for _ in range(3):
+        clock.now += JOB_LEASE_SECONDS - 1
+        queue.renew(job_id)
+    assert queue.claim() is None
+    assert queue.get(job_id)["status"] == "running"
+
+
+def test_jobs_are_claimed_oldest_first(queue, clock):
+    first = queue.submit("generate_suggestions", {"prompt": "first"})
+    clock.now += 1
+    second = queue.submit("analyze_image", {}, blob=b"image")
+    claimed = queue.claim()
+    assert claimed["id"] == first
+    assert claimed["payload"] == {"prompt": "first"}
+    assert queue.get(first)["status"] == "running"
+    assert queue.claim()["blob"] == b"image"
+    assert queue.claim() is None
+    assert queue.get(second)["status"] == "running"
+
+
+def test_concurrent_claims_take_each_job_once(queue):
+    job_ids = {queue.submit("generate_suggestions", {"prompt": str(number)}) for number in range(40)}
+    claimed = []
+
+    def drain():
+        worker_queue = JobQueue(queue.path)
+        while (job := worker_queue.claim()) is not None:
+            claimed.append(job["id"])
+
+    threads = [threading.Thread(target=drain) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(job_ids)
+
+
+def test_job_fails_after_max_attempts(queue, clock):
+    job_id = queue.submit("analyze_image", {}, blob=b"image")
+    for _ in range(MAX_ATTEMPTS):
+        assert queue.claim()["id"] == job_id
+        clock.now += JOB_LEASE_SECONDS + 1
+    assert queue.claim() is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed"
+    assert "abandoned" in job["error"]
+
+
+def test_complete_and_fail_record_the_outcome(queue):
+    done = queue.submit("generate_suggestions", {"prompt": "a"})
+    failed = queue.submit("generate_suggestions", {"prompt": "b"})
+    queue.complete(done, {"raw": "Rinse it.", "structured": None})
+    queue.fail(failed, "ValueError: bad reply")
+    assert queue.get(done)["result"] == {"raw": "Rinse it.", "structured": None}
+    assert queue.get(failed)["error"] == "ValueError: bad reply"
+    queue.delete(done)
+    assert queue.get(done) is None
+
+
+def test_purge_drops_only_abandoned_jobs(queue, clock):
+    old_done = queue.submit("generate_suggestions", {"prompt": "a"})
+    queue.complete(old_done, {"raw": "ok", "structured": None})
+    old_queued = queue.submit("generate_suggestions", {"prompt": "b"})
+    clock.now += job_queue.JOB_RETENTION_SECONDS + 1
+    fresh = queue.submit("generate_suggestions", {"prompt": "c"})
+    assert queue.purge() == 2
+    assert queue.get(old_done) is None
+    assert queue.get(old_queued) is None
+    assert queue.get(fresh)["status"] == "queued"
+
+
+def test_renew_lease_runs_until_stopped(queue, monkeypatch):
+    monkeypatch.setattr(job_queue, "LEASE_RENEW_INTERVAL", 0.01)
+    renewed = []
+    monkeypatch.setattr(queue, "renew", renewed.append)
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=job_queue.renew_lease, args=(queue, "job", stop))
+    heartbeat.start()
+    time.sleep(0.1)
+    stop.set()
+    heartbeat.join(timeout=1)
+    assert not heartbeat.is_alive()
+    assert renewed and set(renewed) == {"job"}
+
+
+def test_models_are_loaded_per_mode(monkeypatch):
+    loaded = []
+
+    def load(api_key, structured_output=False):
+        loaded.append(structured_output)
+        return (f"text-{structured_output}", f"vision-{structured_output}")
+
+    monkeypatch.setattr(job_queue.analysis, "load_gemini_models", load)
+    models = job_queue.ModelLoader("key")
+    assert models.get(True) == ("text-True", "vision-True")
+    assert models.get(False) == ("text-False", "vision-False")
+    assert models.get(True) == ("text-True", "vision-True")
+    assert loaded == [True, False]
+
+
+def test_structured_job_with_unsupported_model_is_rejected(monkeypatch):
+    monkeypatch.setenv("GEMINI_VISION_MODEL", "gemini-pro-vision")
+    models = job_queue.ModelLoader("key")
+    assert models.get(False)[1].model_name == "models/gemini-pro-vision"
+    with pytest.raises(ValueError, match="does not support structured output"):
+        models.get(True)
@@ -0,0 +1,135 @@
+import threading
+
+import pytest
+
+import state_backend
+from state_backend import RedisStateBackend, SQLiteStateBackend, StateBackend, get_state_backend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(state_backend.time, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    return str(tmp_path / "state.db")
+
+
+# Each call returns a new backend sharing the same storage, like separate app processes
+@pytest.fixture(params=["sqlite", "redis"])
+def connect(request, sqlite_path):
+    if request.param == "sqlite":
+        return lambda: SQLiteStateBackend(sqlite_path)
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    return lambda: RedisStateBackend(fakeredis.FakeRedis(server=server))
+
+
+def test_state_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StateBackend()
+
+
+def test_values_round_trip_as_json(connect):
+    backend = connect()
+    assert backend.get("progress:1") is None
+    backend.set("progress:1", {"points": 20, "achievements": ["first_analysis"]})
+    assert connect().get("progress:1") == {"points": 20, "achievements": ["first_analysis"]}
+    backend.delete("progress:1")
+    assert backend.get("progress:1") is None
+
+
+def test_update_applies_to_the_stored_value(connect):
+    backend = connect()
+    assert backend.update("count", lambda value: (value or 0) + 1) == 1
+    assert backend.update("count", lambda value: value + 1) == 2
+    assert connect().get("count") == 2
+
+
+def test_concurrent_updates_are_not_lost(connect):
+    def add_points():
+        backend = connect()
+        for _ in range(25):
+            backend.update("points", lambda value: (value or 0) + 1)
+
+    threads = [threading.Thread(target=add_points) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert connect().get("points") == 100
+
+
+def test_failed_update_leaves_the_value_unchanged(connect):
+    backend = connect()
+    backend.set("points", 10)
+
+    def broken(value):
+        raise ValueError("bad record")
+
+    with pytest.raises(ValueError):
+        backend.update("points", broken)
+    assert backend.get("points") == 10
+
+
+def test_sqlite_values_expire(sqlite_path, clock):
+    backend = SQLiteStateBackend(sqlite_path)
+    backend.set("geocode:paris", [48.85, 2.35], ttl=60)
+    backend.update("image:abc", lambda value: {"raw": "bottle"}, ttl=60)
+    clock.now += 59
+    assert backend.get("geocode:paris") == [48.85, 2.35]
+    clock.now += 2
+    assert backend.get("geocode:paris") is None
+    assert backend.update("image:abc", lambda value: value) is None
+
+
+def test_sqlite_purge_deletes_only_expired_rows(sqlite_path, clock):
+    backend = SQLiteStateBackend(sqlite_path)
+    backend.set("short", 1, ttl=10)
+    backend.set("long", 2, ttl=1000)
+    backend.set("forever", 3)
+    clock.now += 11
+    assert backend.purge() == 1
+    assert backend.get("long") == 2
+    assert backend.get("forever") == 3
+
+
+def test_sqlite_set_sometimes_purges(sqlite_path, clock, monkeypatch):
+    backend = SQLiteStateBackend(sqlite_path)
+    backend.set("short", 1, ttl=10)
+    clock.now += 11
+    monkeypatch.setattr(state_backend, "PURGE_PROBABILITY", 1.0)
+    backend.set("other", 2)
+    with backend._connect() as conn:
+        assert conn.execute("SELECT key FROM state").fetchall() == [("other",)]
+
+
+def test_redis_values_get_a_ttl():
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeRedis()
+    backend = RedisStateBackend(client)
+    backend.set("geocode:paris", [48.85, 2.35], ttl=60)
+    backend.update("image:abc", lambda value: {"raw": "bottle"}, ttl=60)
+    backend.set("progress:1", {"points": 0})
+    assert 0 < client.ttl("ecoquest:geocode:paris") <= 60
+    assert 0 < client.ttl("ecoquest:image:abc") <= 60
+    assert client.ttl("ecoquest:progress:1") == -1
+
+
+def test_get_state_backend_picks_the_backend_from_the_url(sqlite_path, monkeypatch):
+    assert isinstance(get_state_backend(f"sqlite:///{sqlite_path}"), SQLiteStateBackend)
+    monkeypatch.setenv("ECOQUEST_STATE_URL", f"sqlite:///{sqlite_path}")
+    assert get_state_backend().path == sqlite_path
+    with pytest.raises(ValueError):
+        get_state_backend("memcached://localhost")